@@ -11,14 +11,20 @@ IPTV Web App (Aurora build)
 import os
 import re
 import json
+import hashlib
 import sqlite3
 import secrets
 import urllib.request
+import urllib.error
 import urllib.parse
 import subprocess
 import shutil
+import stat
+import itertools
 import threading
 import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
 from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 
@@ -27,7 +33,23 @@ DB_PATH = os.path.join(BASE_DIR, 'app.db')
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 STATIC_DIR = os.path.join(BASE_DIR, 'static')
 CACHE_DIR = os.path.join(BASE_DIR, 'cache')
- 
+
+# Upstream health: per-server circuit breaker and latency tracking
+XTREAM_TIMEOUT = 15
+BREAKER_FAILURES = 3        # consecutive failures before a server is taken out of rotation
+BREAKER_OPEN_SECONDS = 30   # how long before a single trial request is let through again
+_upstream_health = {}
+_upstream_health_lock = threading.Lock()
+
+# HLS capability probing: results cached per (provider, sid)
+HLS_PROBE_TTL_OK = 6 * 3600
+HLS_PROBE_TTL_FAIL = 15 * 60
+HLS_PROBE_MAX_BYTES = 512 * 1024
+HLS_PROBE_BATCH_MAX = 24
+HLS_PROBE_BATCH_DEADLINE = 5   # seconds for a whole batch; slower ids are reported unprobed
+_hls_probe_cache = {}
+_hls_probe_lock = threading.Lock()
+_hls_probe_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hls-probe')
 
 def init_db():
     conn = sqlite3.connect(DB_PATH)
@@ -91,6 +113,23 @@ def init_db():
         );
         """
     )
+    # Migrations for databases created before a column existed
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(iptv_credentials)').fetchall()]
+    if 'mirror_urls' not in cols:
+        conn.execute('ALTER TABLE iptv_credentials ADD COLUMN mirror_urls TEXT')
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(users)').fetchall()]
+    if 'stream_token' not in cols:
+        conn.execute('ALTER TABLE users ADD COLUMN stream_token TEXT')
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(recently_watched)').fetchall()]
+    if 'position' not in cols:
+        conn.execute('ALTER TABLE recently_watched ADD COLUMN position REAL DEFAULT 0')
+    if 'duration' not in cols:
+        conn.execute('ALTER TABLE recently_watched ADD COLUMN duration REAL DEFAULT 0')
+    if 'episode_id' not in cols:
+        conn.execute('ALTER TABLE recently_watched ADD COLUMN episode_id TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_favourites_profile ON favourites(profile_id, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recent_profile ON recently_watched(profile_id, watched_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_recent_item ON recently_watched(profile_id, content_type, item_id)')
     conn.commit()
     conn.close()
 
@@ -99,32 +138,1002 @@ def db_connect():
     conn.row_factory = sqlite3.Row
     return conn
 
+def provider_key(creds):
+    """Identify an upstream Xtream account (server + username)."""
+    return (creds['server_url'] or '', creds['iptv_username'] or '')
+
+class UpstreamUnavailable(Exception):
+    pass
+
+class UpstreamHealth:
+    """Circuit breaker state and EWMA latency for one upstream server URL."""
+
+    def __init__(self, url):
+        self.url = url
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+        self.latency = None
+        self.last_error = None
+
+    def allow(self):
+        now = time.time()
+        with _upstream_health_lock:
+            if self.failures < BREAKER_FAILURES:
+                return True
+            if now < self.open_until or self.trial:
+                return False
+            # Half-open: let exactly one request probe the server
+            self.trial = True
+            return True
+
+    def is_open(self):
+        return self.failures >= BREAKER_FAILURES and (time.time() < self.open_until or self.trial)
+
+    def success(self, elapsed):
+        with _upstream_health_lock:
+            self.failures = 0
+            self.trial = False
+            self.latency = elapsed if self.latency is None else 0.7 * self.latency + 0.3 * elapsed
+
+    def failure(self, error):
+        with _upstream_health_lock:
+            self.failures += 1
+            self.trial = False
+            self.last_error = str(error)
+            if self.failures >= BREAKER_FAILURES:
+                self.open_until = time.time() + BREAKER_OPEN_SECONDS
+
+    def stats(self):
+        return {
+            'server_url': self.url,
+            'state': 'open' if self.is_open() else ('half-open' if self.failures >= BREAKER_FAILURES else 'closed'),
+            'failures': self.failures,
+            'latency_ms': None if self.latency is None else int(self.latency * 1000),
+            'last_error': self.last_error,
+        }
+
+def upstream_health(url):
+    with _upstream_health_lock:
+        h = _upstream_health.get(url)
+        if h is None:
+            h = _upstream_health[url] = UpstreamHealth(url)
+        return h
+
+def parse_mirror_urls(value):
+    """Normalise mirrors given as a list or a comma/newline separated string."""
+    if isinstance(value, str):
+        value = re.split(r'[\s,]+', value)
+    out = []
+    for u in value or []:
+        u = str(u or '').strip().rstrip('/')
+        if not u:
+            continue
+        if not u.startswith('http'):
+            u = 'http://' + u
+        if u not in out:
+            out.append(u)
+    return out
+
+def xtream_servers(creds):
+    """Primary plus mirror server URLs for an account, best candidate first.
+
+    Servers with an open breaker go last and servers with recent failures
+    after healthy ones; ties are broken by observed latency (unmeasured
+    servers count as 1s) and then by configured order.
+    """
+    urls = [creds['server_url']]
+    try:
+        urls += [u for u in parse_mirror_urls(creds['mirror_urls'] or '') if u not in urls]
+    except (IndexError, KeyError):
+        pass
+    ranked = []
+    for idx, u in enumerate(urls):
+        h = upstream_health(u)
+        ranked.append((h.is_open(), h.failures > 0, h.latency if h.latency is not None else 1.0, idx, u))
+    return [r[-1] for r in sorted(ranked)]
+
+def parse_hls_playlist(text):
+    """Inspect an m3u8 body: VOD markers, segment container and advertised codecs."""
+    lower = text.lower()
+    ok = ('#ext-x-endlist' in lower) or ('#ext-x-playlist-type:vod' in lower)
+    codecs = []
+    for m in re.finditer(r'CODECS="([^"]*)"', text, re.IGNORECASE):
+        for c in m.group(1).split(','):
+            c = c.strip()
+            if c and c not in codecs:
+                codecs.append(c)
+    if '#ext-x-map' in lower:
+        container = 'fmp4'
+    elif '.ts' in lower:
+        container = 'ts'
+    else:
+        container = None
+    return {'ok': ok, 'container': container, 'codecs': codecs}
+
+def probe_hls_vod(creds, sid, remote):
+    """Return a cached HLS probe for sid, fetching the m3u8 upstream on miss/expiry."""
+    key = provider_key(creds) + (str(sid),)
+    now = time.time()
+    with _hls_probe_lock:
+        hit = _hls_probe_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+    try:
+        req = urllib.request.Request(remote, headers={'User-Agent': 'Mozilla/5.0'})
+        with urllib.request.urlopen(req, timeout=15) as resp:
+            body = resp.read(HLS_PROBE_MAX_BYTES)
+        info = parse_hls_playlist(body.decode('utf-8', errors='ignore'))
+    except Exception:
+        # Timeouts, refusals and provider connection caps say nothing about the title: not cached
+        return {'ok': False, 'probed': False}
+    if info.get('ok'):
+        result = {'ok': True, 'url': remote, 'container': info['container'], 'codecs': info['codecs']}
+        ttl = HLS_PROBE_TTL_OK
+    else:
+        result = {'ok': False}
+        ttl = HLS_PROBE_TTL_FAIL
+    with _hls_probe_lock:
+        _hls_probe_cache[key] = (now + ttl, result)
+        # Opportunistic purge so the cache does not grow without bound
+        if len(_hls_probe_cache) > 20000:
+            for k in [k for k, v in _hls_probe_cache.items() if v[0] <= now]:
+                _hls_probe_cache.pop(k, None)
+    return result
+
+# Live relay: one upstream connection per channel, fanned out to local viewers
+TS_PACKET = 188
+RELAY_READ_PACKETS = 348                # ~64KB upstream reads, packet aligned
+RELAY_RING_BYTES = 16 * 1024 * 1024     # per-channel backlog before slow clients are dropped
+RELAY_IDLE_LINGER = 10                  # seconds to keep upstream open with no viewers
+RELAY_RECONNECTS = 3
+RELAY_INTERNAL_KEY = secrets.token_hex(16)  # per process; marks the relay reads of our own FFmpeg
+_live_relays = {}
+_live_relays_lock = threading.Lock()
+
+def ts_packet_info(pkt):
+    """Return (pid, payload_unit_start, random_access) for one 188-byte TS packet."""
+    pid = ((pkt[1] & 0x1f) << 8) | pkt[2]
+    pusi = bool(pkt[1] & 0x40)
+    rai = False
+    if (pkt[3] & 0x20) and pkt[4] > 0:
+        rai = bool(pkt[5] & 0x40)
+    return pid, pusi, rai
+
+def ts_pat_pmt_pids(pkt):
+    """Extract PMT PIDs from a PAT packet (single-packet sections only)."""
+    payload = 4
+    if pkt[3] & 0x20:
+        payload += 1 + pkt[4]
+    if not (pkt[1] & 0x40) or payload >= TS_PACKET:
+        return []
+    sec = payload + 1 + pkt[payload]
+    if sec + 8 > TS_PACKET or pkt[sec] != 0x00:
+        return []
+    end = min(sec + 3 + (((pkt[sec + 1] & 0x0f) << 8) | pkt[sec + 2]) - 4, TS_PACKET)
+    pids = []
+    for i in range(sec + 8, end - 3, 4):
+        program = (pkt[i] << 8) | pkt[i + 1]
+        if program != 0:
+            pids.append(((pkt[i + 2] & 0x1f) << 8) | pkt[i + 3])
+    return pids
+
+class LiveRelay:
+    """Single upstream MPEG-TS reader broadcasting into a shared ring buffer.
+
+    Chunks are split so that every packet carrying a random access indicator
+    starts a new ring entry; joiners receive the latest PAT/PMT followed by the
+    newest keyframe entry. Subscribers that fall out of the ring are moved
+    forward to the latest keyframe (drop-on-lag) instead of stalling the reader.
+    """
+
+    def __init__(self, key, remote):
+        self.key = key
+        self.remote = remote
+        self.cond = threading.Condition()
+        self.ring = []              # [(seq, bytes, is_keyframe)]
+        self.ring_bytes = 0
+        self.next_seq = 0
+        self.last_key_seq = None
+        self.pat = None
+        self.pmt = {}
+        self.subscribers = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.drops = 0
+        self.started_at = time.time()
+        self.idle_since = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f'relay-{key[-1]}', daemon=True)
+
+    # --- upstream side
+    def _run(self):
+        failures = 0
+        while not self.closed and failures <= RELAY_RECONNECTS:
+            try:
+                remote = self.remote() if callable(self.remote) else self.remote
+                req = urllib.request.Request(remote, headers={'User-Agent': 'Mozilla/5.0'})
+                with urllib.request.urlopen(req, timeout=15) as resp:
+                    failures = 0
+                    self._pump(resp)
+            except Exception:
+                pass
+            if self._should_stop():
+                break
+            failures += 1
+            time.sleep(min(4, failures))
+        self.close()
+
+    def _pump(self, resp):
+        pending = b''
+        while not self._should_stop():
+            data = resp.read(TS_PACKET * RELAY_READ_PACKETS)
+            if not data:
+                return
+            self.bytes_in += len(data)
+            buf = pending + data
+            start = buf.find(b'\x47')
+            while start >= 0 and start + TS_PACKET < len(buf) and buf[start + TS_PACKET] != 0x47:
+                start = buf.find(b'\x47', start + 1)
+            if start < 0:
+                pending = b''
+                continue
+            usable = (len(buf) - start) // TS_PACKET * TS_PACKET
+            pending = buf[start + usable:]
+            self._publish(memoryview(buf)[start:start + usable])
+
+    def _publish(self, view):
+        cuts = []
+        for off in range(0, len(view), TS_PACKET):
+            pkt = view[off:off + TS_PACKET]
+            pid, pusi, rai = ts_packet_info(pkt)
+            if pid == 0 and pusi:
+                self.pat = bytes(pkt)
+                self.pmt = {p: self.pmt.get(p) for p in ts_pat_pmt_pids(pkt)}
+            elif pusi and pid in self.pmt:
+                self.pmt[pid] = bytes(pkt)
+            if rai:
+                cuts.append(off)
+        bounds = sorted(set([0] + cuts + [len(view)]))
+        with self.cond:
+            for lo, hi in zip(bounds, bounds[1:]):
+                seq = self.next_seq
+                self.next_seq += 1
+                chunk = bytes(view[lo:hi])
+                self.ring.append((seq, chunk, lo in cuts))
+                self.ring_bytes += len(chunk)
+                if lo in cuts:
+                    self.last_key_seq = seq
+            while self.ring_bytes > RELAY_RING_BYTES and len(self.ring) > 1:
+                self.ring_bytes -= len(self.ring.pop(0)[1])
+            self.cond.notify_all()
+
+    def _should_stop(self):
+        with self.cond:
+            if self.closed:
+                return True
+            if self.subscribers == 0 and self.idle_since and time.time() - self.idle_since > RELAY_IDLE_LINGER:
+                # Decide and mark under the lock so a late subscriber cannot attach to a dying relay
+                self.closed = True
+                return True
+        return False
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        with _live_relays_lock:
+            if _live_relays.get(self.key) is self:
+                _live_relays.pop(self.key, None)
+
+    # --- subscriber side
+    def _header(self):
+        parts = [self.pat] + [p for p in self.pmt.values() if p]
+        return b''.join(parts) if self.pat else b''
+
+    def _join_seq(self):
+        if self.last_key_seq is not None and self.ring and self.last_key_seq >= self.ring[0][0]:
+            return self.last_key_seq
+        return self.next_seq
+
+    def subscribe(self):
+        with self.cond:
+            if self.closed:
+                return False
+            self.subscribers += 1
+            self.idle_since = None
+            return True
+
+    def unsubscribe(self):
+        with self.cond:
+            self.subscribers -= 1
+            if self.subscribers <= 0:
+                self.subscribers = 0
+                self.idle_since = time.time()
+
+    def stream(self, write):
+        """Blocking loop feeding ring entries to write() until upstream ends or the client goes away."""
+        seq = None
+        while True:
+            header = b''
+            with self.cond:
+                if seq is None:
+                    seq = self._join_seq()
+                    header = self._header()
+                while not self.closed and seq >= self.next_seq:
+                    self.cond.wait(timeout=5)
+                oldest = self.ring[0][0] if self.ring else self.next_seq
+                if seq < oldest:
+                    # Client lagged past the ring: skip ahead to the newest keyframe
+                    self.drops += 1
+                    seq = None
+                    continue
+                batch = [e[1] for e in self.ring[seq - oldest:]]
+                seq = self.next_seq
+                if self.closed and not batch:
+                    return
+            if header:
+                write(header)
+            sent = 0
+            try:
+                for chunk in batch:
+                    write(chunk)
+                    sent += len(chunk)
+            finally:
+                # Other subscriber threads update the counter too
+                with self.cond:
+                    self.bytes_out += sent
+
+    def stats(self):
+        with self.cond:
+            return {
+                'sid': self.key[-1],
+                'subscribers': self.subscribers,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'lag_drops': self.drops,
+                'buffered_bytes': self.ring_bytes,
+                'uptime': round(time.time() - self.started_at, 1),
+            }
+
+def get_live_relay(creds, sid, remote):
+    """Return the running relay for (provider, sid), starting one if needed."""
+    key = provider_key(creds) + (str(sid),)
+    with _live_relays_lock:
+        relay = _live_relays.get(key)
+        if relay and not relay.closed:
+            return relay
+        relay = LiveRelay(key, remote)
+        _live_relays[key] = relay
+    relay.thread.start()
+    return relay
+
+def live_relay_stats(pkey=None):
+    """Snapshot of active relays, optionally limited to one provider account."""
+    with _live_relays_lock:
+        relays = list(_live_relays.values())
+    return [r.stats() for r in relays if pkey is None or r.key[:2] == pkey]
+
+# Bandwidth shaping (bytes/second, 0 = unlimited). Priority: live > vod/series > prefetch.
+# Lower priorities may only draw from a shared bucket while it is above their floor,
+# which leaves the last part of every budget to live viewers under contention.
+SHAPER_GLOBAL_BPS = 0
+SHAPER_USER_BPS = 0
+SHAPER_TYPE_BPS = {'live': 0, 'vod': 0, 'series': 0, 'prefetch': 0}
+SHAPER_PRIORITY_FLOOR = {'live': 0.0, 'vod': 0.25, 'series': 0.25, 'prefetch': 0.5}
+SHAPER_MIN_BURST = 256 * 1024
+_user_buckets = {}
+_type_buckets = {}
+_shaper_lock = threading.Lock()
+_user_bytes = {}    # cumulative bytes sent per user since start
+_global_bytes = [0]
+
+class TokenBucket:
+    def __init__(self, rate):
+        self.rate = rate
+        self.burst = max(rate, SHAPER_MIN_BURST)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n, floor=0.0):
+        """Block until n tokens can be taken without dropping below floor * burst."""
+        reserve = floor * self.burst
+        n = min(n, self.burst - reserve)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens - n >= reserve:
+                    self.tokens -= n
+                    return
+                wait = (reserve + n - self.tokens) / self.rate
+            time.sleep(min(max(wait, 0.005), 0.25))
+
+_global_bucket = [None]
+
+def shaping_enabled():
+    return bool(SHAPER_GLOBAL_BPS or SHAPER_USER_BPS or any(SHAPER_TYPE_BPS.values()))
+
+def shape(user_id, kind, n):
+    """Account n bytes to user/kind and sleep as long as the type, user and global budgets require."""
+    with _shaper_lock:
+        _user_bytes[user_id] = _user_bytes.get(user_id, 0) + n
+        _global_bytes[0] += n
+        # Buckets are built lazily and rebuilt when their limit changes, so limits set after import are enforced
+        type_bucket = user_bucket = None
+        if SHAPER_TYPE_BPS.get(kind):
+            type_bucket = _type_buckets.get(kind)
+            if type_bucket is None or type_bucket.rate != SHAPER_TYPE_BPS[kind]:
+                type_bucket = _type_buckets[kind] = TokenBucket(SHAPER_TYPE_BPS[kind])
+        if SHAPER_USER_BPS:
+            user_bucket = _user_buckets.get(user_id)
+            if user_bucket is None or user_bucket.rate != SHAPER_USER_BPS:
+                user_bucket = _user_buckets[user_id] = TokenBucket(SHAPER_USER_BPS)
+        global_bucket = None
+        if SHAPER_GLOBAL_BPS:
+            global_bucket = _global_bucket[0]
+            if global_bucket is None or global_bucket.rate != SHAPER_GLOBAL_BPS:
+                global_bucket = _global_bucket[0] = TokenBucket(SHAPER_GLOBAL_BPS)
+    floor = SHAPER_PRIORITY_FLOOR.get(kind, 0.5)
+    if type_bucket:
+        type_bucket.acquire(n)
+    if user_bucket:
+        user_bucket.acquire(n, floor)
+    if global_bucket:
+        global_bucket.acquire(n, floor)
+
+def bandwidth_stats(user_id):
+    with _shaper_lock:
+        user_total = _user_bytes.get(user_id, 0)
+        global_total = _global_bytes[0]
+    return {
+        'user_total_bytes': user_total,
+        'global_total_bytes': global_total,
+        'limits': {'global_bps': SHAPER_GLOBAL_BPS, 'user_bps': SHAPER_USER_BPS, 'type_bps': dict(SHAPER_TYPE_BPS)},
+    }
+
+# Streaming engine: reusable buffers, splice(2) for pipes on Linux, per-stream byte counters
+STREAM_BUF_MIN = 64 * 1024
+STREAM_BUF_MAX = 1024 * 1024
+F_SETPIPE_SZ = 1031
+_active_streams = {}
+_active_streams_lock = threading.Lock()
+_stream_ids = itertools.count(1)
+
+class StreamMeter:
+    """Byte counter for one client stream, registered while the stream is open."""
+
+    def __init__(self, user_id, kind, sid):
+        self.id = next(_stream_ids)
+        self.user_id = user_id
+        self.kind = kind
+        self.sid = str(sid)
+        self.bytes = 0
+        self.started_at = time.time()
+        self.rate = 0.0
+        self._window_at = self.started_at
+        self._window_bytes = 0
+
+    def __enter__(self):
+        with _active_streams_lock:
+            _active_streams[self.id] = self
+        return self
+
+    def __exit__(self, *exc):
+        with _active_streams_lock:
+            _active_streams.pop(self.id, None)
+        return False
+
+    def add(self, n):
+        """Count n sent bytes, then apply rate shaping (may sleep)."""
+        self.bytes += n
+        self._window_bytes += n
+        now = time.time()
+        if now - self._window_at >= 1.0:
+            self.rate = self._window_bytes / (now - self._window_at)
+            self._window_at = now
+            self._window_bytes = 0
+        shape(self.user_id, self.kind, n)
+
+    def stats(self):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        return {
+            'id': self.id, 'kind': self.kind, 'sid': self.sid, 'bytes': self.bytes,
+            'seconds': round(elapsed, 1), 'avg_bps': int(self.bytes / elapsed), 'current_bps': int(self.rate),
+        }
+
+def active_stream_stats(user_id=None):
+    with _active_streams_lock:
+        meters = list(_active_streams.values())
+    return [m.stats() for m in meters if user_id is None or m.user_id == user_id]
+
+def _pipe_fd(src):
+    """File descriptor of src when it is a pipe that splice(2) can read from."""
+    if not hasattr(os, 'splice'):
+        return None
+    try:
+        fd = src.fileno()
+        return fd if stat.S_ISFIFO(os.fstat(fd).st_mode) else None
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def pump_stream(src, sock, meter=None):
+    """Copy src to a client socket until EOF and return the number of bytes sent.
+
+    Pipes (FFmpeg stdout) are spliced straight into the socket without passing
+    through Python. Everything else is read with readinto() into a reused
+    buffer that doubles while reads keep filling it, up to STREAM_BUF_MAX.
+    With shaping enabled transfers stay at STREAM_BUF_MIN so pacing is smooth.
+    """
+    total = 0
+    max_chunk = STREAM_BUF_MIN if shaping_enabled() else STREAM_BUF_MAX
+    fd = _pipe_fd(src)
+    if fd is not None:
+        try:
+            import fcntl
+            fcntl.fcntl(fd, F_SETPIPE_SZ, STREAM_BUF_MAX)
+        except (ImportError, OSError):
+            pass
+        out = sock.fileno()
+        try:
+            while True:
+                n = os.splice(fd, out, max_chunk)
+                if not n:
+                    return total
+                total += n
+                if meter: meter.add(n)
+        except OSError as e:
+            if isinstance(e, (BrokenPipeError, ConnectionResetError)):
+                raise
+            # EINVAL etc.: the socket does not support splice here; fall through to the copy loop
+    size = STREAM_BUF_MIN
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while True:
+        n = src.readinto(view)
+        if not n:
+            return total
+        sock.sendall(view[:n])
+        total += n
+        if meter: meter.add(n)
+        if n == size and size < max_chunk:
+            size *= 2
+            buf = bytearray(size)
+            view = memoryview(buf)
+
+# Catalog cache: upstream JSON kept per provider with content-hash ETags and item versions
+CATALOG_TTL = {'categories': 600, 'streams': 300, 'info': 1200}
+CATALOG_ID_KEYS = ('stream_id', 'series_id', 'category_id')
+CATALOG_SNAPSHOT_INTERVAL = 300
+CATALOG_MEMORY_MAX = 64 * 1024 * 1024   # encoded bytes kept decoded in memory; the rest stays on disk
+CATALOG_REMOVED_MAX = 2000              # removed ids remembered per list for delta requests
+_catalog = {}
+_catalog_versions = {}
+_catalog_lock = threading.Lock()
+_catalog_dirty = set()          # keys changed since the last snapshot write
+_catalog_snapshot_keys = set()  # keys present on disk but not decoded yet
+_catalog_refreshing = set()
+
+def catalog_item_id(item):
+    if isinstance(item, dict):
+        for k in CATALOG_ID_KEYS:
+            if item.get(k) is not None:
+                return str(item[k])
+    return None
+
+def _catalog_evict():
+    """Drop least recently used entries over CATALOG_MEMORY_MAX (caller holds _catalog_lock).
+
+    Evicted keys are re-indexed as snapshot keys, so the next use restores them
+    from disk with their ETag, items and versions intact. Entries not written
+    yet go last; if they are evicted anyway, delta clients get a full list.
+    """
+    total = sum(len(e['body']) for e in _catalog.values())
+    if total <= CATALOG_MEMORY_MAX:
+        return
+    victims = sorted((k for k in _catalog if k not in _catalog_refreshing),
+                     key=lambda k: (k in _catalog_dirty, _catalog[k].get('used', 0)))
+    for ckey in victims:
+        if total <= CATALOG_MEMORY_MAX:
+            break
+        total -= len(_catalog.pop(ckey)['body'])
+        _catalog_dirty.discard(ckey)
+        _catalog_snapshot_keys.add(ckey)
+
+def _catalog_next_version(pkey):
+    # Seeded from wall-clock ms so versions handed out before a restart stay below new ones
+    version = max(_catalog_versions.get(pkey, 0), int(time.time() * 1000)) + 1
+    _catalog_versions[pkey] = version
+    return version
+
+def catalog_is_stale(entry, kind):
+    """True once an entry is past CATALOG_TTL for its kind or was restored from disk."""
+    return bool(entry.get('restored')) or time.time() - entry['fetched_at'] >= CATALOG_TTL.get(kind, 300)
+
+def catalog_fetch(creds, kind, key, fetch):
+    """Return the catalog entry for (provider, kind, key), calling fetch() once it is stale.
+
+    An entry holds the decoded data, the encoded body and its ETag, and the
+    catalog version at which each list item last changed (for delta requests).
+    Entries restored from the on-disk snapshot are served as-is while a
+    background refresh replaces them; a stale entry is also served when the
+    upstream call fails.
+    """
+    pkey = provider_key(creds)
+    ckey = pkey + (kind, str(key))
+    now = time.time()
+    with _catalog_lock:
+        entry = _catalog.get(ckey)
+        if entry:
+            entry['used'] = now
+        if entry and not catalog_is_stale(entry, kind):
+            return entry
+        from_disk = entry is None and ckey in _catalog_snapshot_keys
+    if from_disk:
+        entry = _catalog_restore(ckey)
+    if entry and entry.get('restored'):
+        _catalog_refresh_async(ckey, fetch)
+        return entry
+    try:
+        return _catalog_update(ckey, fetch)
+    except Exception:
+        # Upstream down or circuit open: a stale copy beats an error
+        if entry:
+            return entry
+        raise
+
+def catalog_peek(creds, kind, key):
+    """Cached entry for (provider, kind, key) without ever calling upstream."""
+    ckey = provider_key(creds) + (kind, str(key))
+    with _catalog_lock:
+        entry = _catalog.get(ckey)
+        if entry:
+            entry['used'] = time.time()
+        from_disk = entry is None and ckey in _catalog_snapshot_keys
+    return _catalog_restore(ckey) if from_disk else entry
+
+def catalog_lookup_items(creds, ctype, ids):
+    """Find list items by id across the cached stream lists of one type.
+
+    In-memory lists are searched first; for ids still missing, only the
+    snapshot lists that the on-disk item index maps them to are restored.
+    Never calls upstream.
+    """
+    wanted = set(str(i) for i in ids)
+    found = {}
+    prefix = f'{ctype}:'
+    pkey = provider_key(creds)
+
+    def scan(entry):
+        hits = wanted.intersection(entry['items']) - found.keys()
+        if hits:
+            for it in entry['data']:
+                iid = catalog_item_id(it)
+                if iid in hits:
+                    found[iid] = it
+
+    def matches(k):
+        return k[:2] == pkey and k[2] == 'streams' and k[3].startswith(prefix)
+
+    with _catalog_lock:
+        entries = [e for k, e in _catalog.items() if matches(k)]
+        any_on_disk = any(matches(k) for k in _catalog_snapshot_keys)
+    for entry in entries:
+        scan(entry)
+        if len(found) == len(wanted):
+            return found
+    if not any_on_disk:
+        return found
+    candidates = _snapshot_list_keys(pkey, ctype, wanted - found.keys())
+    with _catalog_lock:
+        on_disk = [k for k in candidates if k in _catalog_snapshot_keys]
+    for ckey in on_disk:
+        entry = _catalog_restore(ckey)
+        if entry:
+            scan(entry)
+        if len(found) == len(wanted):
+            break
+    return found
+
+def _catalog_update(ckey, fetch):
+    pkey = ckey[:2]
+    now = time.time()
+    data = fetch()
+    body = json.dumps(data).encode('utf-8')
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    with _catalog_lock:
+        entry = _catalog.get(ckey)
+        if entry and entry['etag'] == etag:
+            entry['fetched_at'] = entry['used'] = now
+            entry.pop('restored', None)
+            return entry
+        if not data:
+            # Do not pin an empty/failed upstream answer over a good cached one
+            return entry or {'data': data, 'body': body, 'etag': etag, 'version': 0, 'since': 0,
+                             'fetched_at': now, 'items': {}, 'removed': {}}
+        version = _catalog_next_version(pkey)
+        old_items = entry['items'] if entry else {}
+        removed = dict(entry['removed']) if entry else {}
+        items = {}
+        for it in data if isinstance(data, list) else []:
+            iid = catalog_item_id(it)
+            if iid is None:
+                continue
+            h = hashlib.sha1(json.dumps(it, sort_keys=True).encode('utf-8')).hexdigest()
+            prev = old_items.get(iid)
+            items[iid] = prev if prev and prev[0] == h else (h, version)
+            removed.pop(iid, None)
+        for iid in old_items:
+            if iid not in items:
+                removed[iid] = version
+        since = entry['since'] if entry else version
+        if len(removed) > CATALOG_REMOVED_MAX:
+            # Forget the oldest removals; clients older than them get a full list instead
+            cutoff = sorted(removed.values())[-CATALOG_REMOVED_MAX - 1]
+            removed = {iid: v for iid, v in removed.items() if v > cutoff}
+            since = max(since, cutoff)
+        entry = {
+            'data': data, 'body': body, 'etag': etag, 'version': version, 'since': since,
+            'fetched_at': now, 'used': now, 'items': items, 'removed': removed,
+        }
+        _catalog[ckey] = entry
+        _catalog_dirty.add(ckey)
+        _catalog_evict()
+        return entry
+
+def _catalog_refresh_async(ckey, fetch):
+    with _catalog_lock:
+        if ckey in _catalog_refreshing:
+            return
+        _catalog_refreshing.add(ckey)
+
+    def run():
+        try:
+            _catalog_update(ckey, fetch)
+        except Exception:
+            pass
+        finally:
+            with _catalog_lock:
+                _catalog_refreshing.discard(ckey)
+    threading.Thread(target=run, name='catalog-refresh', daemon=True).start()
+
+# --- On-disk snapshot (SQLite, zlib-compressed JSON blobs) under CACHE_DIR
+def catalog_snapshot_path():
+    return os.path.join(CACHE_DIR, 'catalog.db')
+
+def _snapshot_connect():
+    conn = sqlite3.connect(catalog_snapshot_path())
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS catalog (
+            server_url TEXT NOT NULL,
+            username TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER,
+            since INTEGER,
+            fetched_at REAL,
+            etag TEXT,
+            body BLOB,
+            meta BLOB,
+            PRIMARY KEY(server_url, username, kind, key)
+        );
+        """
+    )
+    # Item id -> stream list key, so lookups by id restore only the lists holding them
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS catalog_items (
+            server_url TEXT NOT NULL,
+            username TEXT NOT NULL,
+            ctype TEXT NOT NULL,
+            item_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            PRIMARY KEY(server_url, username, ctype, item_id, key)
+        );
+        """
+    )
+    return conn
+
+def _snapshot_index_items(conn, ckey, item_ids):
+    server_url, username, kind, key = ckey
+    if kind != 'streams':
+        return
+    conn.execute('DELETE FROM catalog_items WHERE server_url=? AND username=? AND key=?', (server_url, username, key))
+    ctype = key.split(':', 1)[0]
+    conn.executemany('INSERT OR IGNORE INTO catalog_items (server_url, username, ctype, item_id, key) VALUES (?, ?, ?, ?, ?)',
+                     [(server_url, username, ctype, iid, key) for iid in item_ids])
+
+def _snapshot_list_keys(pkey, ctype, ids):
+    """Stream list keys on disk that hold any of ids."""
+    ids = list(ids)
+    keys = set()
+    try:
+        conn = _snapshot_connect()
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = conn.execute('SELECT DISTINCT key FROM catalog_items WHERE server_url=? AND username=? AND ctype=? '
+                                f'AND item_id IN ({",".join("?" * len(chunk))})', pkey + (ctype,) + tuple(chunk)).fetchall()
+            keys.update(pkey + ('streams', r[0]) for r in rows)
+        conn.close()
+    except Exception:
+        pass
+    return keys
+
+def catalog_load_snapshot():
+    """Index the snapshot on boot; entry bodies are only decoded on first use."""
+    try:
+        conn = _snapshot_connect()
+        rows = conn.execute('SELECT server_url, username, kind, key, version FROM catalog').fetchall()
+        # Snapshots written before the item index existed: index their lists once
+        unindexed = conn.execute(
+            "SELECT server_url, username, kind, key, meta FROM catalog c WHERE kind='streams' AND NOT EXISTS "
+            "(SELECT 1 FROM catalog_items i WHERE i.server_url=c.server_url AND i.username=c.username AND i.key=c.key)").fetchall()
+        for server_url, username, kind, key, meta in unindexed:
+            items = json.loads(zlib.decompress(meta).decode('utf-8')).get('items', {})
+            _snapshot_index_items(conn, (server_url, username, kind, key), items)
+        conn.commit()
+        conn.close()
+    except Exception:
+        return 0
+    with _catalog_lock:
+        for server_url, username, kind, key, version in rows:
+            _catalog_snapshot_keys.add((server_url, username, kind, key))
+            pkey = (server_url, username)
+            _catalog_versions[pkey] = max(_catalog_versions.get(pkey, 0), version or 0)
+    return len(rows)
+
+def _catalog_restore(ckey):
+    try:
+        conn = _snapshot_connect()
+        row = conn.execute('SELECT version, since, fetched_at, etag, body, meta FROM catalog '
+                           'WHERE server_url=? AND username=? AND kind=? AND key=?', ckey).fetchone()
+        conn.close()
+        if not row:
+            return None
+        version, since, fetched_at, etag, body, meta = row
+        body = zlib.decompress(body)
+        meta = json.loads(zlib.decompress(meta).decode('utf-8'))
+        entry = {
+            'data': json.loads(body.decode('utf-8')), 'body': body, 'etag': etag,
+            'version': version, 'since': since, 'fetched_at': fetched_at,
+            'items': {k: tuple(v) for k, v in meta.get('items', {}).items()},
+            'removed': meta.get('removed', {}), 'restored': True, 'used': time.time(),
+        }
+    except Exception:
+        entry = None
+    with _catalog_lock:
+        _catalog_snapshot_keys.discard(ckey)
+        # A concurrent request may have fetched it from upstream meanwhile
+        if not entry:
+            return _catalog.get(ckey)
+        entry = _catalog.setdefault(ckey, entry)
+        _catalog_evict()
+        return entry
+
+def catalog_save_snapshot():
+    """Write entries changed since the last snapshot to disk."""
+    with _catalog_lock:
+        pending = [(k, _catalog[k]) for k in _catalog_dirty if k in _catalog]
+        _catalog_dirty.clear()
+    if not pending:
+        return 0
+    try:
+        conn = _snapshot_connect()
+        for ckey, e in pending:
+            meta = json.dumps({'items': e['items'], 'removed': e['removed']}).encode('utf-8')
+            conn.execute('INSERT OR REPLACE INTO catalog (server_url, username, kind, key, version, since, fetched_at, etag, body, meta) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         ckey + (e['version'], e['since'], e['fetched_at'], e['etag'],
+                                 zlib.compress(e['body'], 6), zlib.compress(meta, 6)))
+            _snapshot_index_items(conn, ckey, e['items'])
+        conn.commit()
+        conn.close()
+    except Exception:
+        # Keep them dirty so the next pass retries
+        with _catalog_lock:
+            _catalog_dirty.update(k for k, _ in pending)
+        return 0
+    return len(pending)
+
+def catalog_snapshot_loop():
+    while True:
+        time.sleep(CATALOG_SNAPSHOT_INTERVAL)
+        catalog_save_snapshot()
+
+def catalog_delta(entry, since):
+    """Items added/changed and ids removed after catalog version `since`."""
+    if since < entry['since'] or since > entry['version']:
+        return {'version': entry['version'], 'full': True, 'changed': entry['data'], 'removed': []}
+    changed = []
+    for it in entry['data'] if isinstance(entry['data'], list) else []:
+        iid = catalog_item_id(it)
+        if iid is not None and entry['items'][iid][1] > since:
+            changed.append(it)
+    removed = [iid for iid, v in entry['removed'].items() if v > since]
+    return {'version': entry['version'], 'full': False, 'changed': changed, 'removed': removed}
+
+# M3U playlist export: generated from the catalog cache, kept gzip-compressed per user/filter
+PLAYLIST_CACHE_MAX = 32
+_playlist_cache = {}
+_playlist_cache_lock = threading.Lock()
+
+def _m3u_attr(value):
+    return str(value or '').replace('"', "'").replace('\r', ' ').replace('\n', ' ')
+
+def m3u_lines(parts, base, token):
+    """Yield the playlist as encoded blocks, one per category, from (type, category, entry, episodes) parts."""
+    qtoken = urllib.parse.quote(token or '')
+    yield b'#EXTM3U\n'
+    for ctype, cat, entry, episodes in parts:
+        group = _m3u_attr(cat.get('category_name'))
+        out = []
+        for it in entry['data'] if isinstance(entry['data'], list) else []:
+            if not isinstance(it, dict):
+                continue
+            name = _m3u_attr(it.get('name') or it.get('title') or it.get('series_name'))
+            logo = _m3u_attr(it.get('stream_icon') or it.get('cover'))
+            if ctype == 'live':
+                url = f"{base}/relay/live/{it.get('stream_id')}.ts?token={qtoken}"
+                out.append(f'#EXTINF:-1 tvg-id="{_m3u_attr(it.get("epg_channel_id"))}" tvg-name="{name}" '
+                           f'tvg-logo="{logo}" group-title="{group}",{name}\n{url}\n')
+            elif ctype == 'vod':
+                ext = urllib.parse.quote(it.get('container_extension') or 'mp4')
+                url = f"{base}/proxy/vod/{it.get('stream_id')}?ext={ext}&token={qtoken}"
+                out.append(f'#EXTINF:-1 tvg-name="{name}" tvg-logo="{logo}" group-title="{group}",{name}\n{url}\n')
+            else:
+                info = episodes.get(str(it.get('series_id')))
+                seasons = (info or {}).get('episodes') if isinstance(info, dict) else None
+                for season in (seasons.values() if isinstance(seasons, dict) else []):
+                    for ep in season or []:
+                        title = _m3u_attr(f"{name} - {ep.get('title') or ep.get('episode_num')}")
+                        ext = urllib.parse.quote(ep.get('container_extension') or 'mp4')
+                        url = f"{base}/proxy/series/{ep.get('id')}?ext={ext}&token={qtoken}"
+                        out.append(f'#EXTINF:-1 tvg-name="{title}" tvg-logo="{logo}" group-title="{group}",{title}\n{url}\n')
+        if out:
+            yield ''.join(out).encode('utf-8')
+
 class IPTVRequestHandler(SimpleHTTPRequestHandler):
     # Route regex
     re_categories   = re.compile(r'^/categories/(?P<type>[a-zA-Z]+)$')
     re_streams      = re.compile(r'^/streams/(?P<type>[a-zA-Z]+)/(?P<catid>\d+)$')
+    re_streams_delta= re.compile(r'^/streams/(?P<type>[a-zA-Z]+)/(?P<catid>\d+)/delta$')
     re_stream_url   = re.compile(r'^/stream_url/(?P<type>[a-zA-Z]+)/(?P<sid>\d+)$')
     re_info         = re.compile(r'^/info/(?P<itype>vod|series)/(?P<itemid>\d+)$')
     re_profile      = re.compile(r'^/profiles/(?P<pid>\d+)$')
     re_search       = re.compile(r'^/search$')
     re_profile_fav  = re.compile(r'^/profiles/(?P<pid>\d+)/favourites(?:/(?P<fid>\d+))?$')
+    re_profile_dash = re.compile(r'^/profiles/(?P<pid>\d+)/dashboard$')
+    re_profile_recent = re.compile(r'^/profiles/(?P<pid>\d+)/recently_watched$')
     re_compat_vod   = re.compile(r'^/compat/vod/(?P<sid>\d+)$')
     re_compat_live  = re.compile(r'^/compat/live/(?P<sid>\d+)$')
     re_compat_series= re.compile(r'^/compat/series/(?P<sid>\d+)$')
     # IPTV settings helpers
     re_iptv_credentials = re.compile(r'^/iptv/credentials$')
     re_iptv_refresh     = re.compile(r'^/iptv/refresh$')
+    re_iptv_health      = re.compile(r'^/iptv/health$')
     # Proxies / helpers for VOD
     re_proxy_vod    = re.compile(r'^/proxy/vod/(?P<sid>\d+)$')
+    re_proxy_series = re.compile(r'^/proxy/series/(?P<sid>\d+)$')
+    # M3U export for external players
+    re_playlist     = re.compile(r'^/playlist\.(?P<fmt>m3u8?)$')
+    re_playlist_token = re.compile(r'^/playlist/token$')
     re_hls_check_vod= re.compile(r'^/hls/check/vod/(?P<sid>\d+)$')
+    re_hls_check_batch = re.compile(r'^/hls/check/vod$')
+    # Shared upstream relay for raw live MPEG-TS
+    re_relay_live   = re.compile(r'^/relay/live/(?P<sid>\d+)\.ts$')
+    re_relay_stats  = re.compile(r'^/relay/stats$')
+    re_stream_stats = re.compile(r'^/stats/streams$')
     
 
     # --- Helpers
     def end_headers(self):
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Headers', 'Authorization, Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Authorization, Content-Type, If-None-Match')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
-        self.send_header('Access-Control-Expose-Headers', 'Content-Range, Accept-Ranges, Content-Length, Content-Type')
+        self.send_header('Access-Control-Expose-Headers', 'Content-Range, Accept-Ranges, Content-Length, Content-Type, ETag, X-Catalog-Version')
         super().end_headers()
 
     def do_OPTIONS(self):
@@ -164,11 +1173,39 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(data)
 
+    def _send_catalog(self, entry):
+        """Send a catalog entry with its ETag, answering 304 when If-None-Match matches."""
+        inm = self.headers.get('If-None-Match', '')
+        tags = [t.strip()[2:] if t.strip().startswith('W/') else t.strip() for t in inm.split(',')]
+        if inm and (entry['etag'] in tags or '*' in tags):
+            self.send_response(304)
+            self.send_header('ETag', entry['etag'])
+            self.send_header('Cache-Control', 'private, no-cache')
+            self.end_headers()
+            return
+        data = entry['body']
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', len(data))
+        self.send_header('ETag', entry['etag'])
+        self.send_header('X-Catalog-Version', str(entry['version']))
+        self.send_header('Cache-Control', 'private, no-cache')
+        self.end_headers()
+        self.wfile.write(data)
+
     def _err(self, status, message):
         self.send_response(status)
         self.end_headers()
         self.wfile.write(json.dumps({'error': message}).encode())
 
+    def _stream_kind(self, kind):
+        """Shaping class for a stream: prefetches (Sec-Purpose/Purpose header or ?prefetch=1) rank lowest."""
+        purpose = (self.headers.get('Sec-Purpose') or self.headers.get('Purpose') or '').lower()
+        q = parse_qs(urlparse(self.path).query)
+        if 'prefetch' in purpose or q.get('prefetch', [''])[0] == '1':
+            return 'prefetch'
+        return kind
+
     def parse_auth_token(self):
         auth = self.headers.get('Authorization', '')
         parts = auth.split()
@@ -184,13 +1221,16 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
             pass
         return None
 
-    def authenticate(self):
+    def authenticate(self, stream_token_ok=False):
+        """Resolve the caller; read-only stream routes also accept the user's stream token."""
         token = self.parse_auth_token()
         if not token:
             self._err(401, 'Missing authentication token')
             return None
         conn = db_connect()
         row = conn.execute('SELECT * FROM users WHERE token=?', (token,)).fetchone()
+        if not row and stream_token_ok:
+            row = conn.execute('SELECT * FROM users WHERE stream_token=?', (token,)).fetchone()
         conn.close()
         if not row:
             self._err(401, 'Invalid or expired token')
@@ -222,6 +1262,8 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         if m: return self.handle_categories(m.group('type'))
         m = self.re_streams.match(path)
         if m: return self.handle_streams(m.group('type'), m.group('catid'))
+        m = self.re_streams_delta.match(path)
+        if m: return self.handle_streams_delta(m.group('type'), m.group('catid'))
         m = self.re_stream_url.match(path)
         if m: return self.handle_stream_url(m.group('type'), m.group('sid'))
         m = self.re_info.match(path)
@@ -234,11 +1276,27 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         if m: return self.handle_compat_series(m.group('sid'))
         if self.re_iptv_credentials.match(path):
             return self.handle_get_iptv_credentials()
+        if self.re_iptv_health.match(path):
+            return self.handle_iptv_health()
         m = self.re_proxy_vod.match(path)
         if m: return self.handle_proxy_vod(m.group('sid'))
+        m = self.re_proxy_series.match(path)
+        if m: return self.handle_proxy_vod(m.group('sid'), 'series')
+        m = self.re_playlist.match(path)
+        if m: return self.handle_playlist(m.group('fmt'))
+        if self.re_playlist_token.match(path):
+            return self.handle_playlist_token()
         m = self.re_hls_check_vod.match(path)
         if m: return self.handle_hls_check_vod(m.group('sid'))
-        
+        if self.re_hls_check_batch.match(path):
+            return self.handle_hls_check_batch()
+        m = self.re_relay_live.match(path)
+        if m: return self.handle_relay_live(m.group('sid'))
+        if self.re_relay_stats.match(path):
+            return self.handle_relay_stats()
+        if self.re_stream_stats.match(path):
+            return self.handle_stream_stats()
+
         m = self.re_search.match(path)
         if m: return self.handle_search()
 
@@ -246,6 +1304,8 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
             return self.handle_profiles()
         m = self.re_profile.match(path)
         if m: return self.handle_profile_detail(int(m.group('pid')))
+        m = self.re_profile_dash.match(path)
+        if m: return self.handle_profile_dashboard(int(m.group('pid')))
 
         m = self.re_profile_fav.match(path)
         if m and m.group('fid') is None:
@@ -268,10 +1328,14 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         if path == '/iptv/login': return self.handle_iptv_login(data)
         if path == '/iptv/refresh': return self.handle_iptv_refresh()
         if path == '/profiles': return self.handle_create_profile(data)
+        if path == '/playlist/token': return self.handle_playlist_token(rotate=True)
 
         m = self.re_profile_fav.match(path)
         if m and m.group('fid') is None:
             return self.handle_add_favourite(int(m.group('pid')), data)
+        m = self.re_profile_recent.match(path)
+        if m:
+            return self.handle_record_watch(int(m.group('pid')), data)
 
         return self.send_error(404, 'Not Found')
 
@@ -345,6 +1409,7 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
             server_url = 'http://' + server_url
         if not server_url or not u or not p:
             return self._err(400, 'Server URL, username and password are required')
+        mirrors = [m for m in parse_mirror_urls(data.get('mirrors')) if m != server_url]
         # Verify against Xtream player_api.php
         try:
             query = urllib.parse.urlencode({'username': u, 'password': p})
@@ -359,11 +1424,11 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         conn = db_connect()
         have = conn.execute('SELECT id FROM iptv_credentials WHERE user_id=?', (user['id'],)).fetchone()
         if have:
-            conn.execute('UPDATE iptv_credentials SET server_url=?, iptv_username=?, iptv_password=? WHERE user_id=?',
-                         (server_url, u, p, user['id']))
+            conn.execute('UPDATE iptv_credentials SET server_url=?, iptv_username=?, iptv_password=?, mirror_urls=? WHERE user_id=?',
+                         (server_url, u, p, '\n'.join(mirrors), user['id']))
         else:
-            conn.execute('INSERT INTO iptv_credentials (user_id, server_url, iptv_username, iptv_password) VALUES (?, ?, ?, ?)',
-                         (user['id'], server_url, u, p))
+            conn.execute('INSERT INTO iptv_credentials (user_id, server_url, iptv_username, iptv_password, mirror_urls) VALUES (?, ?, ?, ?, ?)',
+                         (user['id'], server_url, u, p, '\n'.join(mirrors)))
         conn.commit()
         conn.close()
         return self._ok_json({'message': 'IPTV credentials saved successfully'})
@@ -376,7 +1441,8 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         if not creds:
             return self._ok_json({})
         # Never return password to client
-        return self._ok_json({'server_url': creds['server_url'] or '', 'username': creds['iptv_username'] or ''})
+        return self._ok_json({'server_url': creds['server_url'] or '', 'username': creds['iptv_username'] or '',
+                              'mirrors': parse_mirror_urls(creds['mirror_urls'] or '')})
 
     def handle_iptv_refresh(self):
         user = self.authenticate()
@@ -386,16 +1452,22 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         if not creds:
             return self._err(400, 'IPTV credentials not set for this user')
         try:
-            query = urllib.parse.urlencode({'username': creds['iptv_username'], 'password': creds['iptv_password']})
-            url = f"{creds['server_url']}/player_api.php?{query}"
-            with urllib.request.urlopen(url, timeout=20) as resp:
-                body = resp.read()
-            data = json.loads(body.decode('utf-8'))
+            data = self.call_xtream(creds)
             ok = isinstance(data, dict) and data.get('user_info', {}).get('auth') == 1
             return self._ok_json({'ok': bool(ok)})
         except Exception as e:
             return self._err(500, f'Refresh failed: {e}')
 
+    def handle_iptv_health(self):
+        """Breaker state and latency for the primary and mirror servers of the caller's account."""
+        user = self.authenticate()
+        if not user:
+            return
+        creds = self.get_xtream_credentials(user['id'])
+        if not creds:
+            return self._err(400, 'IPTV credentials not set for this user')
+        return self._ok_json({'servers': [upstream_health(u).stats() for u in xtream_servers(creds)]})
+
     def handle_profiles(self):
         user = self.authenticate()
         if not user: return
@@ -429,6 +1501,102 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         conn.close()
         return self._ok_json({'id': prof['id'], 'name': prof['name'], 'favourites': favs, 'recently_watched': recs})
 
+    def handle_profile_dashboard(self, pid):
+        """Profile screen in one call: paged favourites, recents and continue-watching.
+
+        Rows are enriched from the cached catalog only; nothing is fetched upstream.
+        Query: page (1-based), per_page (max 100), recent_limit (max 50).
+        """
+        user = self.authenticate()
+        if not user: return
+        q = parse_qs(urlparse(self.path).query)
+        def qint(name, default, lo, hi):
+            try:
+                return max(lo, min(hi, int(q.get(name, [default])[0])))
+            except (TypeError, ValueError):
+                return default
+        page = qint('page', 1, 1, 100000)
+        per_page = qint('per_page', 24, 1, 100)
+        recent_limit = qint('recent_limit', 20, 1, 50)
+        conn = db_connect()
+        prof = conn.execute('SELECT id, name FROM profiles WHERE id=? AND user_id=?', (pid, user['id'])).fetchone()
+        if not prof:
+            conn.close()
+            return self._err(404, 'Profile not found')
+        fav_total = conn.execute('SELECT COUNT(*) FROM favourites WHERE profile_id=?', (pid,)).fetchone()[0]
+        favs = [dict(r) for r in conn.execute(
+            'SELECT id, content_type, item_id, title, thumbnail FROM favourites WHERE profile_id=? ORDER BY id DESC LIMIT ? OFFSET ?',
+            (pid, per_page, (page - 1) * per_page)).fetchall()]
+        # Latest row per item; recently_watched keeps one row per play
+        recs = [dict(r) for r in conn.execute(
+            'SELECT r.id, r.content_type, r.item_id, r.episode_id, r.title, r.thumbnail, r.watched_at, r.position, r.duration '
+            'FROM recently_watched r JOIN (SELECT MAX(id) AS id FROM recently_watched WHERE profile_id=? '
+            'GROUP BY content_type, item_id) latest ON latest.id = r.id ORDER BY r.watched_at DESC, r.id DESC LIMIT ?',
+            (pid, recent_limit)).fetchall()]
+        conn.close()
+        cont = [r for r in recs if r['content_type'] != 'live' and (r['position'] or 0) > 30
+                and (r['duration'] or 0) > 0 and r['position'] < 0.95 * r['duration']]
+        creds = self.get_xtream_credentials(user['id'])
+        if creds:
+            self._attach_catalog_meta(creds, favs + recs)
+        return self._ok_json({
+            'id': prof['id'], 'name': prof['name'],
+            'favourites': {'items': favs, 'page': page, 'per_page': per_page, 'total': fav_total},
+            'recently_watched': recs,
+            'continue_watching': cont,
+        })
+
+    def _attach_catalog_meta(self, creds, rows):
+        """Add a `meta` dict from cached stream lists and info blobs to each row, in place."""
+        by_type = {}
+        for r in rows:
+            by_type.setdefault(r['content_type'], set()).add(str(r['item_id']))
+        items = {t: catalog_lookup_items(creds, t, ids) for t, ids in by_type.items() if t in ('live', 'vod', 'series')}
+        for r in rows:
+            t, iid = r['content_type'], str(r['item_id'])
+            it = items.get(t, {}).get(iid) or {}
+            info = catalog_peek(creds, 'info', f'{t}:{iid}') if t in ('vod', 'series') else None
+            details = (info['data'].get('info') if info and isinstance(info['data'], dict) else None) or {}
+            r['meta'] = {
+                'name': it.get('name') or it.get('series_name') or details.get('name') or r['title'],
+                'cover': it.get('stream_icon') or it.get('cover') or details.get('movie_image') or details.get('cover') or r['thumbnail'],
+                'rating': it.get('rating') or details.get('rating'),
+                'year': str(details.get('releasedate') or details.get('releaseDate') or it.get('year') or '')[:4] or None,
+                'plot': details.get('plot') or it.get('plot'),
+                'container_extension': it.get('container_extension') or details.get('container_extension'),
+                'cached': bool(it or details),
+            }
+
+    def handle_record_watch(self, pid, data):
+        """Record a play (and resume position) in recently_watched.
+
+        Series plays are keyed by the parent series_id in item_id, with the
+        episode in episode_id, so rows join against the series catalog.
+        """
+        user = self.authenticate()
+        if not user: return
+        content_type = data.get('content_type'); item_id = data.get('item_id')
+        if not content_type or not item_id: return self._err(400, 'Invalid watch data')
+        try:
+            position = float(data.get('position') or 0); duration = float(data.get('duration') or 0)
+        except (TypeError, ValueError):
+            return self._err(400, 'Invalid watch data')
+        conn = db_connect()
+        ok = conn.execute('SELECT 1 FROM profiles WHERE id=? AND user_id=?', (pid, user['id'])).fetchone()
+        if not ok:
+            conn.close(); return self._err(404, 'Profile not found')
+        conn.execute('DELETE FROM recently_watched WHERE profile_id=? AND content_type=? AND item_id=?',
+                     (pid, content_type, str(item_id)))
+        episode_id = data.get('episode_id')
+        cur = conn.execute('INSERT INTO recently_watched (profile_id, content_type, item_id, episode_id, title, thumbnail, position, duration) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           (pid, content_type, str(item_id), str(episode_id) if episode_id else None,
+                            data.get('title'), data.get('thumbnail'), position, duration))
+        conn.commit()
+        rid = cur.lastrowid
+        conn.close()
+        return self._ok_json({'id': rid})
+
     def handle_delete_profile(self, pid):
         user = self.authenticate()
         if not user: return
@@ -490,27 +1658,48 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         if action: params['action'] = action
         if extra: params.update(extra or {})
         query = urllib.parse.urlencode(params)
-        url = f"{creds['server_url']}/player_api.php?{query}"
-        with urllib.request.urlopen(url, timeout=30) as resp:
-            body = resp.read()
-        try:
-            return json.loads(body.decode('utf-8'))
-        except Exception:
-            return []
+        last_error = None
+        for server_url in xtream_servers(creds):
+            health = upstream_health(server_url)
+            if not health.allow():
+                continue
+            started = time.time()
+            try:
+                with urllib.request.urlopen(f"{server_url}/player_api.php?{query}", timeout=XTREAM_TIMEOUT) as resp:
+                    body = resp.read()
+            except urllib.error.HTTPError as e:
+                if e.code < 500:
+                    # The server answered: a 4xx is about this account/request, not server health
+                    health.success(time.time() - started)
+                    raise
+                health.failure(e)
+                last_error = e
+                continue
+            except Exception as e:
+                health.failure(e)
+                last_error = e
+                continue
+            health.success(time.time() - started)
+            try:
+                return json.loads(body.decode('utf-8'))
+            except Exception:
+                return []
+        raise UpstreamUnavailable(f'All servers unavailable ({last_error})' if last_error else 'All servers unavailable (circuit open)')
 
     def _build_remote_url(self, creds, ctype, sid, ext='mp4'):
         st = (ctype or '').lower()
         e = (ext or 'mp4')
+        server_url = xtream_servers(creds)[0]
         if st == 'vod':
-            return f"{creds['server_url']}/movie/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{e}"
+            return f"{server_url}/movie/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{e}"
         elif st == 'series':
-            return f"{creds['server_url']}/series/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{e}"
+            return f"{server_url}/series/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{e}"
         elif st == 'live':
-            return f"{creds['server_url']}/live/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.ts"
+            return f"{server_url}/live/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.ts"
         return None
 
-    def handle_proxy_vod(self, sid):
-        user = self.authenticate()
+    def handle_proxy_vod(self, sid, ctype='vod'):
+        user = self.authenticate(stream_token_ok=True)
         if not user:
             return
         creds = self.get_xtream_credentials(user['id'])
@@ -518,7 +1707,7 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
             return self._err(400, 'IPTV credentials not set for this user')
         q = parse_qs(urlparse(self.path).query)
         ext = (q.get('ext', ['mp4'])[0] or 'mp4').strip()
-        remote = self._build_remote_url(creds, 'vod', sid, ext)
+        remote = self._build_remote_url(creds, ctype, sid, ext)
         if not remote:
             return self._err(400, 'Bad request')
         # Forward Range if provided
@@ -546,13 +1735,174 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
                 self.send_header('Cache-Control', 'no-store')
                 self.end_headers()
                 # Stream body
-                for chunk in iter(lambda: resp.read(64 * 1024), b''):
-                    if not chunk:
-                        break
-                    self.wfile.write(chunk)
+                with StreamMeter(user['id'], self._stream_kind(ctype), sid) as meter:
+                    pump_stream(resp, self.connection, meter)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
         except Exception as e:
             return self._err(502, f'Upstream error: {e}')
 
+    def _stream_token(self, user, rotate=False):
+        """Read-only token for external players (playlist, relay and proxy routes only)."""
+        if user['stream_token'] and not rotate:
+            return user['stream_token']
+        token = secrets.token_hex(16)
+        conn = db_connect()
+        conn.execute('UPDATE users SET stream_token=? WHERE id=?', (token, user['id']))
+        conn.commit()
+        conn.close()
+        return token
+
+    def handle_playlist_token(self, rotate=False):
+        """GET returns the stream token and playlist URL; POST rotates the token."""
+        user = self.authenticate()
+        if not user:
+            return
+        token = self._stream_token(user, rotate)
+        host = self.headers.get('Host') or f'127.0.0.1:{self.server.server_address[1]}'
+        proto = self.headers.get('X-Forwarded-Proto') or 'http'
+        return self._ok_json({'token': token, 'url': f'{proto}://{host}/playlist.m3u?token={token}'})
+
+    def _playlist_parts(self, creds, types, cat_filter, tags, fetch=True):
+        """Yield (type, category, entry, episodes) parts, appending each ETag used to tags.
+
+        With fetch=False nothing goes upstream and a missing or stale category or
+        stream list raises LookupError; with fetch=True lists are fetched as the walk reaches them
+        and categories that fail upstream are skipped.
+        """
+        mapping = {'live': 'get_live_categories', 'vod': 'get_vod_categories', 'series': 'get_series_categories'}
+        for t in types:
+            if fetch:
+                try:
+                    cats_entry = catalog_fetch(creds, 'categories', t, lambda t=t: self.call_xtream(creds, mapping[t]))
+                except Exception:
+                    continue
+            else:
+                cats_entry = catalog_peek(creds, 'categories', t)
+                if not cats_entry or catalog_is_stale(cats_entry, 'categories'):
+                    raise LookupError(t)
+            tags.append(cats_entry['etag'])
+            for cat in cats_entry['data'] if isinstance(cats_entry['data'], list) else []:
+                cid = str(cat.get('category_id') or '')
+                if not cid or (cat_filter and cid not in cat_filter):
+                    continue
+                if fetch:
+                    try:
+                        entry = self._streams_entry(creds, t, cid)
+                    except Exception:
+                        continue
+                else:
+                    entry = catalog_peek(creds, 'streams', f'{t}:{cid}')
+                    if not entry or catalog_is_stale(entry, 'streams'):
+                        raise LookupError(cid)
+                tags.append(entry['etag'])
+                episodes = {}
+                if t == 'series':
+                    for it in entry['data'] if isinstance(entry['data'], list) else []:
+                        info = catalog_peek(creds, 'info', f"series:{it.get('series_id')}")
+                        if info:
+                            episodes[str(it.get('series_id'))] = info['data']
+                            tags.append(info['etag'])
+                yield (t, cat, entry, episodes)
+
+    def handle_playlist(self, fmt):
+        """M3U/M3U8 of the caller's catalog for external players.
+
+        Query: token (session or stream token), type=live,vod,series (default
+        live,vod), category=<ids>. Stream URLs carry the read-only stream token.
+        Series episodes are only listed when their info is already cached.
+        """
+        user = self.authenticate(stream_token_ok=True)
+        if not user:
+            return
+        creds = self.get_xtream_credentials(user['id'])
+        if not creds:
+            return self._err(400, 'IPTV credentials not set for this user')
+        q = parse_qs(urlparse(self.path).query)
+        types = [t for t in ','.join(q.get('type', ['live,vod'])).lower().split(',') if t in ('live', 'vod', 'series')]
+        cat_filter = set(c.strip() for c in ','.join(q.get('category', [])).split(',') if c.strip())
+        if not types:
+            return self._err(400, 'Invalid playlist type')
+        host = self.headers.get('Host') or f'127.0.0.1:{self.server.server_address[1]}'
+        proto = self.headers.get('X-Forwarded-Proto') or 'http'
+        base = f'{proto}://{host}'
+        token = self._stream_token(user)
+        key = (user['id'], token, base, tuple(types), tuple(sorted(cat_filter)))
+        content_type = 'application/vnd.apple.mpegurl' if fmt == 'm3u8' else 'audio/x-mpegurl'
+        gzip_ok = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+        with _playlist_cache_lock:
+            cached = _playlist_cache.get(key)
+        if cached:
+            # Still valid while the catalog entries it was built from are fresh and unchanged
+            tags = []
+            try:
+                for _ in self._playlist_parts(creds, types, cat_filter, tags, fetch=False):
+                    pass
+                fingerprint = hashlib.sha1('|'.join(tags).encode('utf-8')).hexdigest()
+            except LookupError:
+                fingerprint = None
+            if cached[0] == fingerprint:
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('ETag', f'"{fingerprint}"')
+                self.send_header('Vary', 'Accept-Encoding')
+                if gzip_ok:
+                    self.send_header('Content-Encoding', 'gzip')
+                    self.send_header('Content-Length', len(cached[1]))
+                    self.end_headers()
+                    self.wfile.write(cached[1])
+                    return
+                # Other clients get the same copy inflated as it is written
+                self.send_header('Content-Length', cached[2])
+                self.end_headers()
+                gunzip = zlib.decompressobj(31)
+                try:
+                    for i in range(0, len(cached[1]), STREAM_BUF_MIN):
+                        self.wfile.write(gunzip.decompress(cached[1][i:i + STREAM_BUF_MIN]))
+                    self.wfile.write(gunzip.flush())
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                return
+
+        # Headers go out first; stream lists are read (and fetched if missing) as the body is written
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        tags = []
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+        compressed = []
+        size = 0
+        try:
+            for block in m3u_lines(self._playlist_parts(creds, types, cat_filter, tags), base, token):
+                if chunked:
+                    self.wfile.write(b'%x\r\n' % len(block) + block + b'\r\n')
+                else:
+                    self.wfile.write(block)
+                compressed.append(gz.compress(block))
+                size += len(block)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        compressed.append(gz.flush())
+        fingerprint = hashlib.sha1('|'.join(tags).encode('utf-8')).hexdigest()
+        # Cached before the body is terminated, so a client's next request can already reuse it
+        with _playlist_cache_lock:
+            _playlist_cache.pop(key, None)
+            _playlist_cache[key] = (fingerprint, b''.join(compressed), size)
+            while len(_playlist_cache) > PLAYLIST_CACHE_MAX:
+                _playlist_cache.pop(next(iter(_playlist_cache)))
+        if chunked:
+            try:
+                self.wfile.write(b'0\r\n\r\n')
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
     def handle_hls_check_vod(self, sid):
         user = self.authenticate()
         if not user:
@@ -560,20 +1910,99 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         creds = self.get_xtream_credentials(user['id'])
         if not creds:
             return self._err(400, 'IPTV credentials not set for this user')
-        # Try to fetch m3u8 and inspect for VOD markers
+        # Fetch m3u8 (or reuse a cached probe) and inspect for VOD markers
         remote = self._build_remote_url(creds, 'vod', sid, 'm3u8')
+        return self._ok_json(probe_hls_vod(creds, sid, remote))
+
+    def handle_hls_check_batch(self):
+        """Probe many VOD ids in parallel: /hls/check/vod?ids=1,2,3"""
+        user = self.authenticate()
+        if not user:
+            return
+        creds = self.get_xtream_credentials(user['id'])
+        if not creds:
+            return self._err(400, 'IPTV credentials not set for this user')
+        q = parse_qs(urlparse(self.path).query)
+        ids = []
+        for raw in ','.join(q.get('ids', [])).split(','):
+            raw = raw.strip()
+            if raw.isdigit() and raw not in ids:
+                ids.append(raw)
+        if not ids:
+            return self._err(400, 'No ids supplied')
+        ids = ids[:HLS_PROBE_BATCH_MAX]
+        futures = {sid: _hls_probe_pool.submit(probe_hls_vod, creds, sid, self._build_remote_url(creds, 'vod', sid, 'm3u8'))
+                   for sid in ids}
+        futures_wait(futures.values(), timeout=HLS_PROBE_BATCH_DEADLINE)
+        results = {}
+        for sid, fut in futures.items():
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                results[sid] = fut.result()
+            else:
+                # Not probed within the deadline: drop queued work, report without caching
+                fut.cancel()
+                results[sid] = {'ok': False, 'probed': False}
+        return self._ok_json({'results': results})
+
+    def handle_relay_live(self, sid):
+        """Raw MPEG-TS for a live channel, sharing one upstream connection across viewers."""
+        user = self.authenticate(stream_token_ok=True)
+        if not user:
+            return
+        creds = self.get_xtream_credentials(user['id'])
+        if not creds:
+            return self._err(400, 'IPTV credentials not set for this user')
+        # Resolved on every (re)connect so the relay follows server failover
+        remote = lambda: self._build_remote_url(creds, 'live', sid)
+        relay = get_live_relay(creds, sid, remote)
+        if not relay.subscribe():
+            # Lost a race with an idle relay shutting down; start a fresh one
+            relay = get_live_relay(creds, sid, remote)
+            if not relay.subscribe():
+                return self._err(503, 'Relay unavailable')
+        # FFmpeg reading for /compat/live is metered on the compat output instead
+        internal_key = parse_qs(urlparse(self.path).query).get('internal', [''])[0]
+        internal = self.client_address[0] == '127.0.0.1' and secrets.compare_digest(internal_key, RELAY_INTERNAL_KEY)
         try:
-            req = urllib.request.Request(remote, headers={'User-Agent': 'Mozilla/5.0'})
-            with urllib.request.urlopen(req, timeout=15) as resp:
-                body = resp.read(512 * 1024)  # up to 512KB
-            text = body.decode('utf-8', errors='ignore')
-            lower = text.lower()
-            ok = ('#ext-x-endlist' in lower) or ('#ext-x-playlist-type:vod' in lower)
-            if ok:
-                return self._ok_json({'ok': True, 'url': remote})
-            return self._ok_json({'ok': False})
-        except Exception:
-            return self._ok_json({'ok': False})
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp2t')
+            self.send_header('Cache-Control', 'no-store')
+            self.end_headers()
+            if internal:
+                relay.stream(self.wfile.write)
+                return
+            with StreamMeter(user['id'], 'live', sid) as meter:
+                def write(chunk):
+                    self.wfile.write(chunk)
+                    meter.add(len(chunk))
+                relay.stream(write)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            relay.unsubscribe()
+
+    def handle_relay_stats(self):
+        user = self.authenticate()
+        if not user:
+            return
+        creds = self.get_xtream_credentials(user['id'])
+        if not creds:
+            return self._ok_json({'relays': []})
+        return self._ok_json({'relays': live_relay_stats(provider_key(creds))})
+
+    def handle_stream_stats(self):
+        """Open proxy/compat/relay streams for the caller with byte counters, throughput and shaping limits."""
+        user = self.authenticate()
+        if not user:
+            return
+        streams = active_stream_stats(user['id'])
+        out = {
+            'streams': streams,
+            'total_bytes': sum(st['bytes'] for st in streams),
+            'total_bps': sum(st['current_bps'] for st in streams),
+        }
+        out.update(bandwidth_stats(user['id']))
+        return self._ok_json(out)
 
     def handle_categories(self, cat_type):
         user = self.authenticate()
@@ -584,22 +2013,46 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         act = mapping.get(cat_type.lower())
         if not act: return self._err(400, 'Invalid category type')
         try:
-            data = self.call_xtream(creds, act)
-            return self._ok_json(data)
+            entry = catalog_fetch(creds, 'categories', cat_type.lower(), lambda: self.call_xtream(creds, act))
+            return self._send_catalog(entry)
         except Exception as e:
             return self._err(500, f'Failed to fetch categories: {e}')
 
+    def _streams_entry(self, creds, stream_type, catid):
+        mapping = {'live': 'get_live_streams', 'vod': 'get_vod_streams', 'series': 'get_series'}
+        act = mapping.get(stream_type.lower())
+        if not act:
+            return None
+        return catalog_fetch(creds, 'streams', f'{stream_type.lower()}:{catid}',
+                             lambda: self.call_xtream(creds, act, {'category_id': catid}))
+
     def handle_streams(self, stream_type, catid):
         user = self.authenticate()
         if not user: return
         creds = self.get_xtream_credentials(user['id'])
         if not creds: return self._err(400, 'IPTV credentials not set for this user')
-        mapping = {'live': 'get_live_streams', 'vod': 'get_vod_streams', 'series': 'get_series'}
-        act = mapping.get(stream_type.lower())
-        if not act: return self._err(400, 'Invalid stream type')
         try:
-            data = self.call_xtream(creds, act, {'category_id': catid})
-            return self._ok_json(data)
+            entry = self._streams_entry(creds, stream_type, catid)
+            if entry is None: return self._err(400, 'Invalid stream type')
+            return self._send_catalog(entry)
+        except Exception as e:
+            return self._err(500, f'Failed to fetch streams: {e}')
+
+    def handle_streams_delta(self, stream_type, catid):
+        """Items changed since ?since=<catalog version> for one stream category."""
+        user = self.authenticate()
+        if not user: return
+        creds = self.get_xtream_credentials(user['id'])
+        if not creds: return self._err(400, 'IPTV credentials not set for this user')
+        q = parse_qs(urlparse(self.path).query)
+        try:
+            since = int(q.get('since', ['0'])[0] or 0)
+        except ValueError:
+            return self._err(400, 'Invalid catalog version')
+        try:
+            entry = self._streams_entry(creds, stream_type, catid)
+            if entry is None: return self._err(400, 'Invalid stream type')
+            return self._ok_json(catalog_delta(entry, since))
         except Exception as e:
             return self._err(500, f'Failed to fetch streams: {e}')
 
@@ -612,14 +2065,14 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         ext = q.get('ext', ['mp4'])[0]
         st = stream_type.lower()
         if st == 'live':
-            url = f"{creds['server_url']}/live/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.ts"
+            url = self._build_remote_url(creds, 'live', sid)
         elif st == 'vod':
             # Prefer MP4 containers; some providers only expose mkv/avi. Keep ext from query but map non-mp4 to mp4 for better seeking.
             if ext.lower() not in ('mp4', 'm4v', 'mov'):
                 ext = 'mp4'
-            url = f"{creds['server_url']}/movie/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{ext}"
+            url = self._build_remote_url(creds, 'vod', sid, ext)
         elif st == 'series':
-            url = f"{creds['server_url']}/series/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{ext}"
+            url = self._build_remote_url(creds, 'series', sid, ext)
         else:
             return self._err(400, 'Unsupported stream type')
         return self._ok_json({'url': url})
@@ -630,10 +2083,14 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         creds = self.get_xtream_credentials(user['id'])
         if not creds: return self._err(400, 'IPTV credentials not set for this user')
         if info_type == 'vod':
-            data = self.call_xtream(creds, 'get_vod_info', {'vod_id': item_id})
+            fetch = lambda: self.call_xtream(creds, 'get_vod_info', {'vod_id': item_id})
         else:
-            data = self.call_xtream(creds, 'get_series_info', {'series_id': item_id})
-        return self._ok_json(data)
+            fetch = lambda: self.call_xtream(creds, 'get_series_info', {'series_id': item_id})
+        try:
+            entry = catalog_fetch(creds, 'info', f'{info_type}:{item_id}', fetch)
+        except Exception as e:
+            return self._err(500, f'Failed to fetch info: {e}')
+        return self._send_catalog(entry)
 
     def handle_search(self):
         user = self.authenticate()
@@ -730,7 +2187,7 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
 
         q = parse_qs(urlparse(self.path).query)
         ext = q.get('ext', ['mp4'])[0]
-        remote = f"{creds['server_url']}/movie/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{ext}"
+        remote = self._build_remote_url(creds, 'vod', sid, ext)
 
         # Use segmenting to enable accurate duration and instant seeking across long movies
         cmd = [
@@ -747,8 +2204,8 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
             self.send_header('Content-Type', 'video/mp4')
             self.send_header('Cache-Control', 'no-store')
             self.end_headers()
-            for chunk in iter(lambda: p.stdout.read(64 * 1024), b''):
-                self.wfile.write(chunk)
+            with StreamMeter(user['id'], self._stream_kind('vod'), sid) as meter:
+                pump_stream(p.stdout, self.connection, meter)
             p.stdout.close()
             p.wait(timeout=5)
         except BrokenPipeError:
@@ -774,7 +2231,10 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
         if not shutil.which('ffmpeg'):
             return self._err(500, 'FFmpeg not found on server PATH')
 
-        remote = f"{creds['server_url']}/live/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.ts"
+        # Read through the local relay so compat viewers share the upstream slot with raw viewers
+        # FFmpeg's argv is visible to local users: pass the read-only stream token, not the session token
+        token = urllib.parse.quote(self._stream_token(user))
+        remote = f"http://127.0.0.1:{self.server.server_address[1]}/relay/live/{sid}.ts?token={token}&internal={RELAY_INTERNAL_KEY}"
         cmd = [
             'ffmpeg','-hide_banner','-loglevel','error',
             '-fflags','+nobuffer','-reconnect','1','-reconnect_streamed','1','-reconnect_delay_max','4',
@@ -789,8 +2249,8 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
             self.send_header('Content-Type', 'video/mp4')
             self.send_header('Cache-Control', 'no-store')
             self.end_headers()
-            for chunk in iter(lambda: p.stdout.read(64 * 1024), b''):
-                self.wfile.write(chunk)
+            with StreamMeter(user['id'], 'live', sid) as meter:
+                pump_stream(p.stdout, self.connection, meter)
         except BrokenPipeError:
             try:
                 p.kill()
@@ -816,7 +2276,7 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
 
         q = parse_qs(urlparse(self.path).query)
         ext = q.get('ext', ['mp4'])[0]
-        remote = f"{creds['server_url']}/series/{creds['iptv_username']}/{creds['iptv_password']}/{sid}.{ext}"
+        remote = self._build_remote_url(creds, 'series', sid, ext)
 
         cmd = [
             'ffmpeg','-hide_banner','-loglevel','error',
@@ -832,8 +2292,8 @@ class IPTVRequestHandler(SimpleHTTPRequestHandler):
             self.send_header('Content-Type', 'video/mp4')
             self.send_header('Cache-Control', 'no-store')
             self.end_headers()
-            for chunk in iter(lambda: p.stdout.read(64 * 1024), b''):
-                self.wfile.write(chunk)
+            with StreamMeter(user['id'], self._stream_kind('series'), sid) as meter:
+                pump_stream(p.stdout, self.connection, meter)
             p.stdout.close()
             p.wait(timeout=5)
         except BrokenPipeError:
@@ -856,10 +2316,17 @@ def run_server(port=5000):
         os.makedirs(CACHE_DIR, exist_ok=True)
     except Exception:
         pass
+    restored = catalog_load_snapshot()
+    if restored:
+        print(f"Catalog snapshot: {restored} entries available for warm start")
+    threading.Thread(target=catalog_snapshot_loop, name='catalog-snapshot', daemon=True).start()
     addr = ('', port)
     httpd = ThreadingHTTPServer(addr, IPTVRequestHandler)
     print(f"Serving on port {port}...")
-    httpd.serve_forever()
+    try:
+        httpd.serve_forever()
+    finally:
+        catalog_save_snapshot()
 
 if __name__ == '__main__':
     run_server()
@@ -634,6 +634,7 @@ document.addEventListener('DOMContentLoaded', () => {
           const items = await cachedFetchJson('/streams/vod/' + cat.category_id, 300);
           if (Array.isArray(items)) {
             items.slice(0,10).forEach(item => row.appendChild(createVodCard(item)));
+            prefetchHlsProbes(items.slice(0,10).map(it => it.stream_id));
             const seeCard = document.createElement('div');
             seeCard.className = 'card-item';
             const seeImg = document.createElement('img');
@@ -681,6 +682,7 @@ document.addEventListener('DOMContentLoaded', () => {
       const streams = await cachedFetchJson('/streams/vod/' + cat.category_id, 300);
       if (!Array.isArray(streams)) { moviesAllStreams.textContent = 'Failed to load streams'; return; }
       streams.forEach(item => moviesAllStreams.appendChild(createVodCard(item)));
+      prefetchHlsProbes(streams.map(it => it.stream_id));
     } catch {
       moviesAllStreams.textContent = 'Failed to load streams';
     }
@@ -812,11 +814,12 @@ document.addEventListener('DOMContentLoaded', () => {
       label.textContent = (ep.title || ('Episode ' + ep.episode_num));
       epDiv.appendChild(img); epDiv.appendChild(label);
       epDiv.addEventListener('click', () => {
-        playStream('series', ep.id, label.textContent, 'mp4');
+        playStream('series', ep.id, label.textContent, 'mp4', currentAbout && currentAbout.type === 'series' ? currentAbout.id : null);
         aboutOverlay.classList.add('hidden');
       });
       episodesGrid.appendChild(epDiv);
     });
+    prefetchHlsProbes(list.map(ep => ep.id));
   }
 
   async function fetchInfo(kind, id) {
@@ -847,10 +850,69 @@ document.addEventListener('DOMContentLoaded', () => {
     if (res.ok) alert('Added to My List'); else alert('Failed to add');
   });
 
+  // HLS capability probes (server caches per provider+id; we keep a per-page map)
+  // Only the first cards of a row/grid are prefetched, one batch in flight at a time.
+  const HLS_BATCH_SIZE = 24;
+  const HLS_PREFETCH_MAX = 24;
+  const hlsProbes = new Map(); // id -> probe result
+  const hlsQueue = [];
+  let hlsInFlight = false;
+  function prefetchHlsProbes(ids) {
+    try {
+      (ids || []).slice(0, HLS_PREFETCH_MAX).forEach(id => {
+        const k = String(id || '');
+        if (/^\d+$/.test(k) && !hlsProbes.has(k) && !hlsQueue.includes(k)) hlsQueue.push(k);
+      });
+      pumpHlsQueue();
+    } catch {}
+  }
+  function pumpHlsQueue() {
+    if (hlsInFlight || !hlsQueue.length) return;
+    const chunk = hlsQueue.splice(0, HLS_BATCH_SIZE).filter(k => !hlsProbes.has(k));
+    if (!chunk.length) return pumpHlsQueue();
+    hlsInFlight = true;
+    authFetch('/hls/check/vod?ids=' + chunk.join(','))
+      .then(r => r.json())
+      .then(data => {
+        const results = (data && data.results) || {};
+        chunk.forEach(k => { const r = results[k]; if (r && r.probed !== false) hlsProbes.set(k, r); });
+      })
+      .catch(() => {})
+      .finally(() => { hlsInFlight = false; pumpHlsQueue(); });
+  }
+  async function getHlsProbe(id) {
+    const k = String(id);
+    // Use a finished prefetch; never wait on one still in flight
+    if (hlsProbes.has(k)) return hlsProbes.get(k);
+    try {
+      const chk = await authFetch('/hls/check/vod/' + id).then(r => r.json());
+      if (chk && chk.probed !== false) hlsProbes.set(k, chk);
+      return chk;
+    } catch { return null; }
+  }
+
   // Playback
   let currentPlayback = null; // {type, id}
 
+  // Remember the play (and resume point) for the profile dashboard
+  function recordWatch(pb) {
+    const pid = localStorage.getItem('profileId');
+    if (!pid || !pb) return;
+    const payload = {
+      content_type: pb.type === 'compat-live' ? 'live' : pb.type,
+      // Episodes are recorded under their series so the dashboard can join series metadata
+      item_id: pb.seriesId || pb.id,
+      episode_id: pb.seriesId ? pb.id : '',
+      title: pb.title || '',
+      thumbnail: pb.thumb || '',
+      position: isFinite(video.currentTime) ? video.currentTime : 0,
+      duration: isFinite(video.duration) ? video.duration : 0
+    };
+    authFetch('/profiles/' + pid + '/recently_watched', {method:'POST', headers:{'Content-Type':'application/json'}, body: JSON.stringify(payload)}).catch(() => {});
+  }
+
   playerClose.addEventListener('click', async () => {
+    try { recordWatch(currentPlayback); } catch {}
     try { video.pause(); } catch {}
     player.classList.add('hidden');
     exitFullscreenIfAny();
@@ -859,7 +921,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
   // Removed unload cache clearing
 
-  async function playStream(type, id, title, ext) {
+  async function playStream(type, id, title, ext, seriesId) {
     const tokenParam = 'token=' + encodeURIComponent(token);
     const needsToken = (u) => typeof u === 'string' && (u.startsWith('/') || u.startsWith(window.location.origin));
     const addTokenIfNeeded = (u) => needsToken(u) ? (u + (u.includes('?') ? '&' : '?') + tokenParam) : u;
@@ -879,12 +941,9 @@ document.addEventListener('DOMContentLoaded', () => {
       const candidates = [];
       if (type === 'vod') {
         // Decide between HLS VOD and MP4 proxy
-        let hlsOk = false; let hlsUrl = '';
-        try {
-          const chk = await authFetch('/hls/check/vod/' + id).then(r => r.json());
-          hlsOk = !!(chk && chk.ok);
-          hlsUrl = (chk && chk.url) || '';
-        } catch {}
+        const chk = await getHlsProbe(id);
+        const hlsOk = !!(chk && chk.ok);
+        const hlsUrl = (chk && chk.url) || '';
         if (hlsOk && hlsUrl) {
           candidates.push(hlsUrl);
         } else {
@@ -898,16 +957,15 @@ document.addEventListener('DOMContentLoaded', () => {
       } else if (type === 'live') {
         // Prefer live compat first to keep same-origin for booster
         candidates.push(addTokenIfNeeded('/compat/live/' + id));
+        // Raw TS through the shared relay before going to the provider directly
+        candidates.push(addTokenIfNeeded('/relay/live/' + id + '.ts'));
         const direct = await getDirectUrl();
         if (direct) candidates.push(direct);
       } else if (type === 'series') {
         // Series behaves like VOD: try HLS VOD per-episode id; if not, MP4/proxy/compat
-        let hlsOk = false; let hlsUrl = '';
-        try {
-          const chk = await authFetch('/hls/check/vod/' + id).then(r => r.json());
-          hlsOk = !!(chk && chk.ok);
-          hlsUrl = (chk && chk.url) || '';
-        } catch {}
+        const chk = await getHlsProbe(id);
+        const hlsOk = !!(chk && chk.ok);
+        const hlsUrl = (chk && chk.url) || '';
         if (hlsOk && hlsUrl) {
           candidates.push(hlsUrl);
         } else {
@@ -1011,28 +1069,56 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // No cache lifecycle
-    currentPlayback = { type, id: String(id), ext: ext };
+    currentPlayback = { type, id: String(id), ext: ext, title: title || '', thumb: (aboutCover && aboutCover.src) || '', seriesId: seriesId ? String(seriesId) : '' };
     buildCandidates().then(cands => tryPlay(cands, 0));
   }
 
   // Caching helpers and boot preload
   const cache = {
-    get(key) {
+    peek(key) {
       try {
         const raw = localStorage.getItem('cache:' + key);
         if (!raw) return null;
         const obj = JSON.parse(raw);
         if (!obj || typeof obj !== 'object') return null;
-        const { v, t, ttl } = obj;
-        if (Date.now() - t > ttl) { localStorage.removeItem('cache:' + key); return null; }
-        return v;
+        return obj;
       } catch { return null; }
     },
-    set(key, value, ttlMs) {
-      try { localStorage.setItem('cache:' + key, JSON.stringify({ v: value, t: Date.now(), ttl: ttlMs })); } catch {}
+    get(key) {
+      const obj = cache.peek(key);
+      if (!obj) return null;
+      // Keep expired entries that carry validators; they are revalidated instead of refetched
+      if (Date.now() - obj.t > obj.ttl) { if (!obj.e && !obj.n) localStorage.removeItem('cache:' + key); return null; }
+      return obj.v;
+    },
+    set(key, value, ttlMs, etag, version) {
+      try { localStorage.setItem('cache:' + key, JSON.stringify({ v: value, t: Date.now(), ttl: ttlMs, e: etag || '', n: version || 0 })); } catch {}
     }
   };
 
+  function itemKey(it) {
+    if (!it || typeof it !== 'object') return null;
+    const id = it.stream_id ?? it.series_id ?? it.category_id;
+    return (id === undefined || id === null) ? null : String(id);
+  }
+
+  // Apply a /streams/<type>/<cat>/delta response to a cached list
+  function mergeDelta(list, delta) {
+    if (delta.full) return delta.changed || [];
+    const removed = new Set((delta.removed || []).map(String));
+    const changed = new Map();
+    (delta.changed || []).forEach(it => { const k = itemKey(it); if (k !== null) changed.set(k, it); });
+    const out = [];
+    (list || []).forEach(it => {
+      const k = itemKey(it);
+      if (k !== null && removed.has(k)) return;
+      if (k !== null && changed.has(k)) { out.push(changed.get(k)); changed.delete(k); return; }
+      out.push(it);
+    });
+    changed.forEach(it => out.push(it));
+    return out;
+  }
+
   async function cachedFetchJson(path, ttlSeconds, bypassCacheOnce) {
     const key = path;
     const ttlMs = (ttlSeconds || 300) * 1000;
@@ -1040,9 +1126,29 @@ document.addEventListener('DOMContentLoaded', () => {
       const cached = cache.get(key);
       if (cached !== null && cached !== undefined) return cached;
     }
-    const resp = await authFetch(path);
+    const stale = cache.peek(key);
+    if (stale && stale.n && Array.isArray(stale.v) && /^\/streams\/[a-z]+\/\d+$/i.test(path)) {
+      try {
+        const dres = await authFetch(path + '/delta?since=' + encodeURIComponent(stale.n));
+        if (dres.ok) {
+          const delta = await dres.json();
+          const merged = mergeDelta(stale.v, delta);
+          // An unchanged list keeps its ETag; either way the version keeps the entry revalidatable
+          const unchanged = !delta.full && !(delta.changed || []).length && !(delta.removed || []).length;
+          cache.set(key, merged, ttlMs, unchanged ? stale.e : '', delta.version);
+          return merged;
+        }
+      } catch {}
+    }
+    const opts = {};
+    if (stale && stale.e) opts.headers = { 'If-None-Match': stale.e };
+    const resp = await authFetch(path, opts);
+    if (resp.status === 304 && stale) {
+      cache.set(key, stale.v, ttlMs, stale.e, stale.n);
+      return stale.v;
+    }
     const data = await resp.json();
-    if (resp.ok) cache.set(key, data, ttlMs);
+    if (resp.ok) cache.set(key, data, ttlMs, resp.headers.get('ETag'), Number(resp.headers.get('X-Catalog-Version')) || 0);
     return data;
   }
 